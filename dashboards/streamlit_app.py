@@ -29,6 +29,22 @@ COLORS = {
     'gradient': ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f']
 }
 
+# Anomaly detection settings
+ANOMALY_SEGMENT_KEYS = ['market_id', 'hour', 'store_primary_category']
+ANOMALY_METRICS = {
+    'delivery_duration_minute': 'delay',
+    'orders_per_partner': 'load'
+}
+ANOMALY_MIN_SEGMENT_ORDERS = 30
+ANOMALY_Z_THRESHOLD = 3.5
+MAD_SCALE = 1.4826  # Makes MAD consistent with the standard deviation for normal data
+
+# Utilization response settings (fixed edges keep bins comparable across filters)
+UTIL_STATS_KEYS = ['market_id', 'date', 'store_primary_category']
+UTIL_BIN_EDGES = np.linspace(0, 1, 21)
+LOAD_BIN_EDGES = np.linspace(0, 4, 21)  # Last bin is open-ended
+UTIL_MIN_BIN_ORDERS = 20
+
 # Enhanced professional CSS
 st.markdown("""
 <style>
@@ -179,66 +195,190 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def preprocess_orders(df):
+    """Derive time, partner and performance fields for raw delivery rows"""
+    # Convert date columns to datetime
+    df['created_at'] = pd.to_datetime(df['created_at'])
+    df['actual_delivery_time'] = pd.to_datetime(df['actual_delivery_time'])
+    
+    # Ensure logical constraints
+    df['total_busy_partners'] = np.minimum(df['total_busy_partners'], df['total_onshift_partners'])
+    df['num_distinct_items'] = np.minimum(df['num_distinct_items'], df['total_items'])
+    
+    # Calculate derived fields
+    df['hour'] = df['created_at'].dt.hour
+    df['day_of_week'] = df['created_at'].dt.day_name()
+    df['date'] = df['created_at'].dt.date
+    df['month'] = df['created_at'].dt.month
+    
+    # Handle division by zero for partner_utilization and orders_per_partner
+    df['partner_utilization'] = np.where(
+        df['total_onshift_partners'] > 0,
+        df['total_busy_partners'] / df['total_onshift_partners'],
+        0
+    )
+    df['orders_per_partner'] = np.where(
+        df['total_onshift_partners'] > 0,
+        df['total_outstanding_orders'] / df['total_onshift_partners'],
+        0
+    )
+    
+    # Replace any remaining infinite values with 1.0 (100% utilization) or NaN
+    df['partner_utilization'] = df['partner_utilization'].replace([np.inf, -np.inf], 1.0)
+    df['orders_per_partner'] = df['orders_per_partner'].replace([np.inf, -np.inf], 0)
+    
+    # Handle NaN values
+    df['partner_utilization'] = df['partner_utilization'].fillna(0)
+    df['orders_per_partner'] = df['orders_per_partner'].fillna(0)
+    
+    # Categorize delivery performance based on dataset values
+    df['delivery_performance'] = pd.cut(
+        df['delivery_duration_minute'], 
+        bins=[0, 20, 35, 50, float('inf')], 
+        labels=['Excellent (<20min)', 'Good (20-35min)', 'Average (35-50min)', 'Poor (>50min)']
+    )
+    
+    # Price per item
+    df['price_per_item'] = np.where(
+        df['total_items'] > 0,
+        df['subtotal'] / df['total_items'],
+        0
+    )
+    
+    return df
+
 @st.cache_data
 def load_data():
     """Load and preprocess the Porter delivery data from CSV"""
     try:
         # Load the dataset from the specified path
         df = pd.read_csv('porter_cleaned.csv')
-        
-        # Convert date columns to datetime
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        df['actual_delivery_time'] = pd.to_datetime(df['actual_delivery_time'])
-        
-        # Ensure logical constraints
-        df['total_busy_partners'] = np.minimum(df['total_busy_partners'], df['total_onshift_partners'])
-        df['num_distinct_items'] = np.minimum(df['num_distinct_items'], df['total_items'])
-        
-        # Calculate derived fields
-        df['hour'] = df['created_at'].dt.hour
-        df['day_of_week'] = df['created_at'].dt.day_name()
-        df['date'] = df['created_at'].dt.date
-        df['month'] = df['created_at'].dt.month
-        
-        # Handle division by zero for partner_utilization and orders_per_partner
-        df['partner_utilization'] = np.where(
-            df['total_onshift_partners'] > 0,
-            df['total_busy_partners'] / df['total_onshift_partners'],
-            0
-        )
-        df['orders_per_partner'] = np.where(
-            df['total_onshift_partners'] > 0,
-            df['total_outstanding_orders'] / df['total_onshift_partners'],
-            0
-        )
-        
-        # Replace any remaining infinite values with 1.0 (100% utilization) or NaN
-        df['partner_utilization'] = df['partner_utilization'].replace([np.inf, -np.inf], 1.0)
-        df['orders_per_partner'] = df['orders_per_partner'].replace([np.inf, -np.inf], 0)
-        
-        # Handle NaN values
-        df['partner_utilization'] = df['partner_utilization'].fillna(0)
-        df['orders_per_partner'] = df['orders_per_partner'].fillna(0)
-        
-        # Categorize delivery performance based on dataset values
-        df['delivery_performance'] = pd.cut(
-            df['delivery_duration_minute'], 
-            bins=[0, 20, 35, 50, float('inf')], 
-            labels=['Excellent (<20min)', 'Good (20-35min)', 'Average (35-50min)', 'Poor (>50min)']
-        )
-        
-        # Price per item
-        df['price_per_item'] = np.where(
-            df['total_items'] > 0,
-            df['subtotal'] / df['total_items'],
-            0
-        )
-        
-        return df
+        return preprocess_orders(df)
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         return None
 
+def compute_segment_baselines(df):
+    """Compute robust median/MAD baselines per market × hour × category segment"""
+    keys = ANOMALY_SEGMENT_KEYS
+    grouped = df.groupby(keys, observed=True)
+
+    baselines = pd.DataFrame({'segment_orders': grouped.size()})
+    global_baseline = {}
+    for metric, prefix in ANOMALY_METRICS.items():
+        # MAD = median of absolute deviations from the segment median
+        median = grouped[metric].transform('median')
+        abs_dev = (df[metric] - median).abs()
+        baselines[f'{prefix}_median'] = grouped[metric].median()
+        baselines[f'{prefix}_mad'] = abs_dev.groupby([df[k] for k in keys], observed=True).median()
+
+        global_median = df[metric].median()
+        global_baseline[f'{prefix}_median'] = global_median
+        global_baseline[f'{prefix}_mad'] = (df[metric] - global_median).abs().median()
+
+    # Sparse segments are too noisy to trust, so they fall back to the global baseline
+    sparse = baselines['segment_orders'] < ANOMALY_MIN_SEGMENT_ORDERS
+    for column, value in global_baseline.items():
+        baselines.loc[sparse, column] = value
+
+    return baselines.reset_index(), global_baseline
+
+def score_anomalies(df, baselines, global_baseline):
+    """Score orders against segment baselines using robust z-scores in one pass"""
+    keys = ANOMALY_SEGMENT_KEYS
+    merged = df[keys].merge(baselines, on=keys, how='left')
+    merged.index = df.index
+
+    scored = df.copy()
+    for metric, prefix in ANOMALY_METRICS.items():
+        median = merged[f'{prefix}_median'].fillna(global_baseline[f'{prefix}_median'])
+        mad = merged[f'{prefix}_mad'].fillna(global_baseline[f'{prefix}_mad'])
+        # Guard against zero spread in tightly clustered segments
+        mad = mad.where(mad > 0, max(global_baseline[f'{prefix}_mad'], 1e-6))
+        scored[f'{prefix}_score'] = (df[metric] - median) / (MAD_SCALE * mad)
+
+    scored['is_delay_anomaly'] = scored['delay_score'] > ANOMALY_Z_THRESHOLD
+    scored['is_overload_anomaly'] = scored['load_score'] > ANOMALY_Z_THRESHOLD
+    scored['is_anomaly'] = scored['is_delay_anomaly'] | scored['is_overload_anomaly']
+    return scored
+
+@st.cache_data
+def load_scored_data():
+    """Load the dataset together with its segment baselines and anomaly scores"""
+    df = load_data()
+    if df is None:
+        return None, None, None
+    baselines, global_baseline = compute_segment_baselines(df)
+    return score_anomalies(df, baselines, global_baseline), baselines, global_baseline
+
+def append_new_orders(scored_df, new_orders, baselines, global_baseline):
+    """Score only newly appended orders against existing baselines"""
+    new_scored = score_anomalies(new_orders, baselines, global_baseline)
+    return pd.concat([scored_df, new_scored], ignore_index=True)
+
+def assign_bins(values, edges):
+    """Map values to fixed bin indices, clamping out-of-range values to the edge bins"""
+    bins = np.searchsorted(edges, values, side='right') - 1
+    return np.clip(bins, 0, len(edges) - 2)
+
+def compute_utilization_stats(df):
+    """Aggregate delivery time count/sum/sum of squares per market/day/category and 2D bin"""
+    stats = df[UTIL_STATS_KEYS].copy()
+    stats['util_bin'] = assign_bins(df['partner_utilization'].to_numpy(), UTIL_BIN_EDGES)
+    stats['load_bin'] = assign_bins(df['orders_per_partner'].to_numpy(), LOAD_BIN_EDGES)
+    stats['delivery_sum'] = df['delivery_duration_minute']
+    stats['delivery_sumsq'] = df['delivery_duration_minute'] ** 2
+
+    return stats.groupby(UTIL_STATS_KEYS + ['util_bin', 'load_bin'], observed=True).agg(
+        orders=('delivery_sum', 'size'),
+        delivery_sum=('delivery_sum', 'sum'),
+        delivery_sumsq=('delivery_sumsq', 'sum')
+    ).reset_index()
+
+def merge_utilization_stats(*stats):
+    """Merge binned statistics tables by summing their additive moments"""
+    combined = pd.concat(stats, ignore_index=True)
+    return combined.groupby(UTIL_STATS_KEYS + ['util_bin', 'load_bin'], observed=True)[
+        ['orders', 'delivery_sum', 'delivery_sumsq']
+    ].sum().reset_index()
+
+def summarize_utilization_stats(stats, by):
+    """Roll binned statistics up to mean delivery time with 95% confidence bands"""
+    summary = stats.groupby(by)[['orders', 'delivery_sum', 'delivery_sumsq']].sum()
+    n = summary['orders']
+    summary['mean_delivery'] = summary['delivery_sum'] / n
+    # Sample variance from raw moments, clipped to absorb floating point error
+    variance = (summary['delivery_sumsq'] - n * summary['mean_delivery'] ** 2) / (n - 1)
+    summary['std_delivery'] = np.sqrt(variance.clip(lower=0))
+    margin = 1.96 * summary['std_delivery'] / np.sqrt(n)
+    summary['ci_lower'] = summary['mean_delivery'] - margin
+    summary['ci_upper'] = summary['mean_delivery'] + margin
+    return summary.reset_index()
+
+@st.cache_data
+def load_utilization_stats():
+    """Build the binned utilization statistics once for the full dataset"""
+    df = load_data()
+    if df is None:
+        return None
+    return compute_utilization_stats(df)
+
+def apply_filters(data, date_range, selected_category, selected_market):
+    """Apply sidebar filters to order rows or binned statistics alike"""
+    if len(date_range) == 2:
+        data = data[
+            (data['date'] >= date_range[0]) & 
+            (data['date'] <= date_range[1])
+        ]
+    
+    if selected_category != 'All Categories':
+        data = data[data['store_primary_category'] == selected_category]
+    
+    if selected_market != 'All Markets':
+        data = data[data['market_id'] == selected_market]
+    
+    return data
+
 def format_number(num):
     """Convert large numbers to compact K/M/B format"""
     if num >= 1_000_000_000:
@@ -430,8 +570,9 @@ def create_operational_metrics(df):
     
     with col1:
         # Partner utilization vs delivery time
-        df['util_bins'] = pd.cut(df['partner_utilization'], bins=5, labels=['Very Low', 'Low', 'Medium', 'High', 'Very High'])
-        util_performance = df.groupby('util_bins')['delivery_duration_minute'].mean()
+        df['util_bins'] = pd.cut(df['partner_utilization'], bins=[0, 0.2, 0.4, 0.6, 0.8, 1.0], include_lowest=True,
+                                 labels=['Very Low', 'Low', 'Medium', 'High', 'Very High'])
+        util_performance = df.groupby('util_bins', observed=False)['delivery_duration_minute'].mean()
         
         fig = px.bar(x=util_performance.index, y=util_performance.values,
                     title='Delivery Time vs Partner Utilization',
@@ -463,6 +604,64 @@ def create_operational_metrics(df):
         )
         st.plotly_chart(fig, use_container_width=True)
 
+def create_utilization_response(util_stats):
+    """Create utilization response curves from pre-aggregated binned statistics"""
+    st.markdown('<div class="section-header">📈 Utilization–Delay Response</div>', unsafe_allow_html=True)
+
+    if util_stats['orders'].sum() == 0:
+        st.info("No orders for the current filters.")
+        return
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # Mean delivery time per utilization bin with 95% confidence band
+        curve = summarize_utilization_stats(util_stats, ['util_bin'])
+        curve = curve[curve['orders'] >= UTIL_MIN_BIN_ORDERS]
+        curve['utilization'] = (UTIL_BIN_EDGES[curve['util_bin']] + UTIL_BIN_EDGES[curve['util_bin'] + 1]) / 2 * 100
+
+        fig = go.Figure([
+            go.Scatter(x=curve['utilization'], y=curve['ci_upper'], mode='lines',
+                       line=dict(width=0), showlegend=False, hoverinfo='skip'),
+            go.Scatter(x=curve['utilization'], y=curve['ci_lower'], mode='lines',
+                       line=dict(width=0), fill='tonexty', fillcolor='rgba(214, 39, 40, 0.2)',
+                       name='95% CI', hoverinfo='skip'),
+            go.Scatter(x=curve['utilization'], y=curve['mean_delivery'], mode='lines+markers',
+                       line=dict(color=COLORS['warning']), name='Mean Delivery Time',
+                       customdata=curve['orders'],
+                       hovertemplate='%{x:.1f}% utilization<br>%{y:.1f} min<br>%{customdata:,} orders<extra></extra>')
+        ])
+        fig.update_layout(
+            title='Delivery Time Response to Partner Utilization',
+            height=400,
+            title_x=0.15,
+            xaxis_title="Partner Utilization (%)",
+            yaxis_title="Average Delivery Time (min)"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    with col2:
+        # Utilization × orders per partner heatmap, masking sparse cells
+        grid = summarize_utilization_stats(util_stats, ['util_bin', 'load_bin'])
+        grid.loc[grid['orders'] < UTIL_MIN_BIN_ORDERS, 'mean_delivery'] = np.nan
+        heatmap = grid.pivot(index='load_bin', columns='util_bin', values='mean_delivery').reindex(
+            index=range(len(LOAD_BIN_EDGES) - 1), columns=range(len(UTIL_BIN_EDGES) - 1)
+        )
+        load_labels = [f"{edge:.1f}" for edge in LOAD_BIN_EDGES[:-1]]
+        load_labels[-1] += '+'
+
+        fig = px.imshow(heatmap.values, x=[f"{edge * 100:.0f}%" for edge in UTIL_BIN_EDGES[:-1]], y=load_labels,
+                       origin='lower', aspect='auto', color_continuous_scale='RdYlGn_r',
+                       title='Avg Delivery Time by Utilization and Load')
+        fig.update_layout(
+            height=400,
+            title_x=0.2,
+            xaxis_title="Partner Utilization (bin start)",
+            yaxis_title="Orders per Partner (bin start)",
+            coloraxis_colorbar=dict(title="min")
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
 def create_market_analysis(df):
     """Create market-level analysis"""
     st.markdown('<div class="section-header">📍 Market Performance Analysis</div>', unsafe_allow_html=True)
@@ -504,6 +703,69 @@ def create_market_analysis(df):
         )
         st.plotly_chart(fig, use_container_width=True)
 
+def create_anomaly_detection(df):
+    """Surface orders and markets that deviate from their segment baselines"""
+    st.markdown('<div class="section-header">🚨 Delay & Overload Anomalies</div>', unsafe_allow_html=True)
+
+    flagged = df[df['is_anomaly']]
+    if flagged.empty:
+        st.info("No anomalous orders for the current filters.")
+        return
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # Markets with the highest share of flagged orders
+        market_flags = df.groupby('market_id').agg(
+            orders=('is_anomaly', 'size'),
+            delay_anomalies=('is_delay_anomaly', 'sum'),
+            overload_anomalies=('is_overload_anomaly', 'sum'),
+            anomaly_rate=('is_anomaly', 'mean')
+        ).reset_index()
+        market_flags = market_flags.nlargest(10, 'anomaly_rate')
+
+        fig = px.bar(market_flags, x=market_flags['market_id'].astype(str),
+                    y=market_flags['anomaly_rate'] * 100,
+                    title='Markets by Anomalous Order Share',
+                    color=market_flags['anomaly_rate'] * 100, color_continuous_scale='Reds',
+                    hover_data=['orders', 'delay_anomalies', 'overload_anomalies'])
+        fig.update_layout(
+            height=400,
+            showlegend=False,
+            title_x=0.25,
+            xaxis_title="Market ID",
+            yaxis_title="Anomalous Orders (%)"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    with col2:
+        # Delay vs load scores for flagged orders
+        anomaly_type = np.select(
+            [flagged['is_delay_anomaly'] & flagged['is_overload_anomaly'], flagged['is_delay_anomaly']],
+            ['Delay + Overload', 'Delay'],
+            default='Overload'
+        )
+        fig = px.scatter(flagged, x='load_score', y='delay_score', color=anomaly_type,
+                        title='Flagged Orders: Delay vs Load Score',
+                        color_discrete_sequence=[COLORS['warning'], COLORS['secondary'], COLORS['info']],
+                        hover_data=['market_id', 'hour', 'store_primary_category'])
+        fig.update_layout(
+            height=400,
+            title_x=0.25,
+            xaxis_title="Orders per Partner Score (robust z)",
+            yaxis_title="Delivery Time Score (robust z)",
+            legend_title_text="Anomaly Type"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    # Most severe flagged orders
+    severity = flagged[['delay_score', 'load_score']].max(axis=1)
+    top_flagged = flagged.loc[severity.nlargest(20).index, [
+        'created_at', 'market_id', 'store_primary_category', 'delivery_duration_minute',
+        'orders_per_partner', 'delay_score', 'load_score'
+    ]]
+    st.dataframe(top_flagged.round(2), use_container_width=True)
+
 def create_financial_analysis(df):
     """Create financial performance analysis"""
     st.markdown('<div class="section-header">💰 Financial Performance</div>', unsafe_allow_html=True)
@@ -550,7 +812,7 @@ def create_financial_analysis(df):
         )
         st.plotly_chart(fig, use_container_width=True)
 
-def show_professional_recommendations(df):
+def show_professional_recommendations(df, util_stats):
     """Display professional recommendations with enhanced styling"""
     st.markdown("""
     <div class="recommendation-container">
@@ -561,8 +823,22 @@ def show_professional_recommendations(df):
     # Calculate insights
     peak_hour = df.groupby('hour')['delivery_duration_minute'].mean().idxmax()
     slowest_category = df.groupby('store_primary_category')['delivery_duration_minute'].mean().idxmax()
-    high_util_impact = df[df['partner_utilization'] > 0.8]['delivery_duration_minute'].mean()
-    low_util_impact = df[df['partner_utilization'] < 0.3]['delivery_duration_minute'].mean()
+    
+    # Compare the fastest and slowest utilization bands from the binned response curve
+    util_curve = summarize_utilization_stats(util_stats, ['util_bin'])
+    util_curve = util_curve[util_curve['orders'] >= UTIL_MIN_BIN_ORDERS].set_index('util_bin')
+    if len(util_curve) >= 2:
+        best_bin = util_curve['mean_delivery'].idxmin()
+        worst_bin = util_curve['mean_delivery'].idxmax()
+        util_description = (
+            f"Delivery times are lowest at {UTIL_BIN_EDGES[best_bin]:.0%}-{UTIL_BIN_EDGES[best_bin + 1]:.0%} partner utilization "
+            f"({util_curve.loc[best_bin, 'mean_delivery']:.1f} min) and peak at "
+            f"{UTIL_BIN_EDGES[worst_bin]:.0%}-{UTIL_BIN_EDGES[worst_bin + 1]:.0%} "
+            f"({util_curve.loc[worst_bin, 'mean_delivery']:.1f} min). Rebalancing partners toward the optimal band "
+            f"can save up to {util_curve.loc[worst_bin, 'mean_delivery'] - util_curve.loc[best_bin, 'mean_delivery']:.1f} minutes per order."
+        )
+    else:
+        util_description = "Not enough orders in the current selection to estimate the utilization response curve."
     
     recommendations = [
         {
@@ -581,7 +857,7 @@ def show_professional_recommendations(df):
         },
         {
             "title": "⚖️ Partner Utilization Balance",
-            "description": f"Maintain optimal partner utilization between 60-70%. Current high utilization increases delivery time by {high_util_impact-low_util_impact:.1f} minutes.",
+            "description": util_description,
             "impact": "High",
             "timeline": "Ongoing",
             "roi": "20-25% improvement in delivery efficiency"
@@ -627,7 +903,7 @@ def main():
     """, unsafe_allow_html=True)
     
     # Load data
-    df = load_data()
+    df, baselines, global_baseline = load_scored_data()
     if df is None:
         st.error("Unable to load data. Please check your data source.")
         return
@@ -635,6 +911,17 @@ def main():
     # Sidebar filters
     st.sidebar.markdown("### 🔍 Dashboard Filters")
     
+    # New orders are scored against the cached baselines without recomputing them
+    util_stats = load_utilization_stats()
+    new_orders_file = st.sidebar.file_uploader("Append New Orders (CSV)", type='csv')
+    if new_orders_file is not None:
+        try:
+            new_orders = preprocess_orders(pd.read_csv(new_orders_file))
+            df = append_new_orders(df, new_orders, baselines, global_baseline)
+            util_stats = merge_utilization_stats(util_stats, compute_utilization_stats(new_orders))
+        except Exception as e:
+            st.sidebar.error(f"Error appending orders: {str(e)}")
+    
     # Date range filter
     date_range = st.sidebar.date_input(
         "Select Date Range",
@@ -652,19 +939,8 @@ def main():
     selected_market = st.sidebar.selectbox("Market ID", markets)
     
     # Apply filters
-    filtered_df = df.copy()
-    
-    if len(date_range) == 2:
-        filtered_df = filtered_df[
-            (filtered_df['date'] >= date_range[0]) & 
-            (filtered_df['date'] <= date_range[1])
-        ]
-    
-    if selected_category != 'All Categories':
-        filtered_df = filtered_df[filtered_df['store_primary_category'] == selected_category]
-    
-    if selected_market != 'All Markets':
-        filtered_df = filtered_df[filtered_df['market_id'] == selected_market]
+    filtered_df = apply_filters(df.copy(), date_range, selected_category, selected_market)
+    filtered_util_stats = apply_filters(util_stats, date_range, selected_category, selected_market)
     
     # Dashboard sections
     create_kpi_metrics(filtered_df)
@@ -672,9 +948,11 @@ def main():
     create_category_analysis(filtered_df)
     create_time_analysis(filtered_df)
     create_operational_metrics(filtered_df)
+    create_utilization_response(filtered_util_stats)
     create_market_analysis(filtered_df)
+    create_anomaly_detection(filtered_df)
     create_financial_analysis(filtered_df)
-    show_professional_recommendations(filtered_df)
+    show_professional_recommendations(filtered_df, filtered_util_stats)
     
     # Footer
     st.markdown("""